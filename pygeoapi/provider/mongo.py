@@ -27,17 +27,231 @@
 #
 # =================================================================
 
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import datetime, timedelta
+import functools
+import importlib
 import logging
+import math
+import threading
+import time
 
-from bson import Code
+from dateutil.parser import parse as dateparse
 from pymongo import MongoClient
 from pymongo import GEOSPHERE
 from pymongo import ASCENDING, DESCENDING
+from pymongo import UpdateOne
+from pymongo import uri_parser
 from pymongo.collection import ObjectId
-from pygeoapi.provider.base import BaseProvider
+from pymongo.errors import OperationFailure
+from pygeoapi.provider.base import BaseProvider, ProviderQueryError
 
 LOGGER = logging.getLogger(__name__)
 
+# wire compressors by preference and the modules pymongo needs for them,
+# zlib is always available
+COMPRESSOR_MODULES = [('zstd', 'zstandard'), ('snappy', 'snappy')]
+
+
+def _available_compressors():
+    """
+    Get the wire compressors usable in this environment
+
+    :returns: comma separated compressor names
+    """
+    compressors = []
+    for compressor, module in COMPRESSOR_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        compressors.append(compressor)
+    compressors.append('zlib')
+    return ','.join(compressors)
+
+
+# client options used unless set in the connection string
+CLIENT_DEFAULTS = {
+    'maxPoolSize': 100,
+    'appname': 'pygeoapi',
+    'compressors': _available_compressors()
+}
+
+# number of documents sampled when discovering property names and types
+FIELD_SAMPLE_SIZE = 100
+
+# server error code of a sort exceeding memory without disk use
+SORT_MEMORY_ERROR = 292
+
+# top level fields of a stored GeoJSON feature returned to clients
+FEATURE_PROJECTION = {'_id': 1, 'type': 1, 'geometry': 1, 'properties': 1}
+
+INDEX_DIRECTIONS = {
+    'asc': ASCENDING,
+    'desc': DESCENDING,
+    'compound': ASCENDING
+}
+
+# collection storing discovered fields, shared by all worker processes
+FIELDS_CACHE_COLLECTION = 'pygeoapi_schema_cache'
+# in process cache of discovered fields by (data, collection), holding
+# (expiry time, fields)
+_FIELDS_CACHE = {}
+
+# indexes created or found by this process, by (data, collection), so
+# that index DDL is not sent again for every loaded provider
+_INDEXES = {}
+
+# in process cache of recent query results by (data, collection, query)
+_QUERY_CACHE = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+QUERY_CACHE_SIZE = 64
+# writes per (data, collection), so results computed across a write
+# are not cached
+_QUERY_GENERATIONS = {}
+
+FIELD_TYPES = {
+    bool: 'boolean',
+    int: 'integer',
+    float: 'number',
+    str: 'string',
+    datetime: 'date'
+}
+
+# defaults telling which components a datetime value leaves out
+DATETIME_DEFAULT = datetime(2000, 1, 1)
+DATETIME_PROBE = datetime(2001, 2, 2, 1, 1, 1)
+
+# spatial operators selectable for bbox queries
+BBOX_OPERATORS = {
+    'intersects': '$geoIntersects',
+    'within': '$geoWithin'
+}
+
+# lets MongoDB interpret polygons larger than a hemisphere by winding order
+STRICT_WINDING_CRS = {
+    'type': 'name',
+    'properties': {'name': 'urn:x-mongodb:crs:strictwinding:EPSG:4326'}
+}
+
+# maximum length in degrees of the edges of a bbox polygon; MongoDB joins
+# vertices by great circle arcs, which only stay close to a parallel
+# over short distances
+BBOX_EDGE_STEP = 1.0
+
+
+def _edge_steps(start, end):
+    """
+    Coordinates from start to end, at most BBOX_EDGE_STEP apart
+
+    :param start: first coordinate
+    :param end: last coordinate
+
+    :returns: list of floats including start and end
+    """
+    count = max(1, int(math.ceil(abs(end - start) / BBOX_EDGE_STEP)))
+    return [start + (end - start) * i / count for i in range(count + 1)]
+
+
+def bbox_polygon(minx, miny, maxx, maxy):
+    """
+    Build a GeoJSON Polygon from a bounding box
+
+    Edges are densified so that the great circle arcs MongoDB draws
+    between vertices follow the parallels and meridians of the box. The
+    exterior ring is counter-clockwise and uses the strict winding CRS,
+    so boxes larger than a hemisphere are not inverted. Edges on a pole
+    collapse into a single vertex.
+
+    :param minx: minimum longitude
+    :param miny: minimum latitude
+    :param maxx: maximum longitude, at most 360 degrees east of minx
+    :param maxy: maximum latitude
+
+    :returns: dict of GeoJSON Polygon
+    """
+    boundary = ([[x, miny] for x in _edge_steps(minx, maxx)] +
+                [[maxx, y] for y in _edge_steps(miny, maxy)] +
+                [[x, maxy] for x in _edge_steps(maxx, minx)] +
+                [[minx, y] for y in _edge_steps(maxy, miny)])
+
+    ring = []
+    for x, y in boundary:
+        if abs(y) >= 90:
+            # all longitudes meet at the poles
+            x = minx
+        if not ring or ring[-1] != [x, y]:
+            ring.append([x, y])
+
+    return {
+        'type': 'Polygon',
+        'coordinates': [ring],
+        'crs': STRICT_WINDING_CRS
+    }
+
+
+def bbox_polygons(minx, miny, maxx, maxy):
+    """
+    Build the GeoJSON Polygons covering a bounding box
+
+    A box crossing the antimeridian is split there. A box spanning all
+    longitudes is split in two, as its western and eastern edges would
+    be the same meridian.
+
+    :param minx: minimum longitude
+    :param miny: minimum latitude
+    :param maxx: maximum longitude, west of minx when crossing the
+                 antimeridian
+    :param maxy: maximum latitude
+
+    :returns: list of dicts of GeoJSON Polygon
+    """
+    if minx > maxx:
+        return [bbox_polygon(x1, miny, x2, maxy)
+                for x1, x2 in ((minx, 180.0), (-180.0, maxx)) if x1 < x2]
+
+    if maxx - minx >= 360:
+        midx = (minx + maxx) / 2.0
+        return [bbox_polygon(minx, miny, midx, maxy),
+                bbox_polygon(midx, miny, maxx, maxy)]
+
+    return [bbox_polygon(minx, miny, maxx, maxy)]
+
+
+@functools.lru_cache(maxsize=None)
+def _client_for(uri):
+    """
+    Get the MongoClient for a connection string
+
+    Clients are shared by all providers in a process, so that they share
+    one connection pool and set of monitor threads.
+
+    :param uri: MongoDB connection string
+
+    :returns: pymongo.MongoClient
+    """
+    options = uri_parser.parse_uri(uri)['options']
+    kwargs = {k: v for k, v in CLIENT_DEFAULTS.items() if k not in options}
+
+    LOGGER.debug('Creating MongoClient')
+    return MongoClient(uri, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def _find_accepts_disk_use(uri):
+    """
+    Check whether the server takes allowDiskUse on find (MongoDB 4.4+)
+
+    Older servers never spill find sorts to disk, so they need no option.
+
+    :param uri: MongoDB connection string
+
+    :returns: bool
+    """
+    version = _client_for(uri).server_info()['versionArray']
+    return version >= [4, 4]
+
 
 class MongoProvider(BaseProvider):
     """Generic provider for Mongodb.
@@ -60,76 +274,584 @@ class MongoProvider(BaseProvider):
 
         LOGGER.info('Mongo source config: {}'.format(self.data))
 
-        dbclient = MongoClient(self.data)
+        dbclient = _client_for(self.data)
         self.featuredb = dbclient.get_default_database()
         self.collection = provider_def['collection']
-        self.featuredb[self.collection].create_index([("geometry", GEOSPHERE)])
+
+        # indexes already ensured on this collection
+        self._indexes = _INDEXES.setdefault((self.data, self.collection),
+                                            set())
+
+        self._ensure_index([("geometry", GEOSPHERE)])
+
+        # document key of the time field, built once per provider
+        self._time_key = None
+
+        if self.time_field is not None:
+            self._time_key = 'properties.' + self.time_field
+            self._ensure_index([(self._time_key, ASCENDING)])
+            # serves the common bbox + datetime combination
+            self._ensure_index(
+                [("geometry", GEOSPHERE), (self._time_key, ASCENDING)])
+
+        # create indexes on queried properties on the fly
+        self.auto_index = provider_def.get('auto_index', False)
+        # count unfiltered queries exactly instead of from metadata
+        self.exact_count = provider_def.get('exact_count', False)
+        # seconds before cached field information expires
+        self.fields_cache_ttl = provider_def.get('fields_cache_ttl', 3600)
+        # seconds query results are cached for, 0 disables caching
+        self.query_cache_ttl = provider_def.get('query_cache_ttl', 0)
+
+        bbox_op = provider_def.get('bbox_op', 'intersects')
+        if bbox_op not in BBOX_OPERATORS:
+            msg = 'Unknown bbox_op: {}'.format(bbox_op)
+            LOGGER.error(msg)
+            raise ProviderQueryError(msg)
+        # spatial operator of bbox queries
+        self._bbox_operator = BBOX_OPERATORS[bbox_op]
+
+        for index in provider_def.get('indexes', []):
+            self._create_index(index)
+
+        LOGGER.debug('Grabbing field information')
+        self.fields = self.get_fields()
+
+    def _create_index(self, index):
+        """
+        Create an index on feature properties from its configuration
+
+        :param index: dict of index definition, `key` being a property
+                      name or a list of them and `type` one of
+                      `asc`, `desc` or `compound`
+        """
+        keys = index['key']
+        if not isinstance(keys, list):
+            keys = [keys]
+
+        direction = INDEX_DIRECTIONS.get(index.get('type', 'asc'))
+        if direction is None:
+            LOGGER.error('Unknown index type: {}'.format(index['type']))
+            return
+
+        self._ensure_index(
+            [('properties.' + key, direction) for key in keys])
+
+    def _ensure_index(self, keys, **kwargs):
+        """
+        Create an index, unless this process already did so
+
+        Only indexes known to exist are remembered, as queries hint them.
+
+        :param keys: list of (key, direction) tuples
+        :param kwargs: index options passed to create_index
+        """
+        spec = tuple(keys)
+        if spec in self._indexes:
+            return
+
+        LOGGER.debug('Creating index on {}'.format(keys))
+        collection = self.featuredb[self.collection]
+        try:
+            collection.create_index(keys, **kwargs)
+        except OperationFailure as err:
+            # an existing index with different options still serves
+            # queries, a missing privilege leaves no index at all
+            LOGGER.warning(err)
+            try:
+                existing = [tuple(index['key']) for index in
+                            collection.index_information().values()]
+            except OperationFailure as err:
+                LOGGER.warning(err)
+                return
+            if spec not in existing:
+                return
+        self._indexes.add(spec)
+
+    def _ensure_index_for_properties(self, prop_names):
+        """
+        Lazily create a sparse index for each queried property
+
+        :param prop_names: list of property names
+        """
+        for prop_name in prop_names:
+            key = 'properties.' + prop_name
+            # any index led by the key serves equality filters on it
+            if any(spec[0][0] == key for spec in self._indexes):
+                continue
+            self._ensure_index([(key, ASCENDING)], sparse=True)
 
     def get_fields(self):
         """
         Get provider field information (names, types)
 
+        Fields are cached in process and in a schema cache collection
+        shared by all workers. Both expire `fields_cache_ttl` seconds
+        after discovery.
+
+        :returns: dict of fields
+        """
+        key = (self.data, self.collection)
+        cached = _FIELDS_CACHE.get(key)
+        if cached is None or cached[0] <= datetime.utcnow():
+            fields_, updated = self._load_fields()
+            expires = updated + timedelta(seconds=self.fields_cache_ttl)
+            cached = _FIELDS_CACHE[key] = (expires, fields_)
+        return cached[1]
+
+    def refresh_fields(self):
+        """
+        Drop cached field information and discover it again
+
+        Other processes pick up the new fields once their own cached
+        copy expires.
+
+        :returns: dict of fields
+        """
+        _FIELDS_CACHE.pop((self.data, self.collection), None)
+        try:
+            self.featuredb[FIELDS_CACHE_COLLECTION].delete_one(
+                {'_id': self.collection})
+        except OperationFailure as err:
+            LOGGER.warning(err)
+
+        self.fields = self.get_fields()
+        return self.fields
+
+    def _load_fields(self):
+        """
+        Read field information from the schema cache collection, or
+        discover and store it there when missing or expired
+
+        :returns: tuple of dict of fields and time of discovery
+        """
+        cache = self.featuredb[FIELDS_CACHE_COLLECTION]
+        now = datetime.utcnow()
+
+        # the TTL index only garbage collects, as it may have been
+        # created with another collection's fields_cache_ttl
+        cached = cache.find_one({
+            '_id': self.collection,
+            'updated': {'$gt': now - timedelta(seconds=self.fields_cache_ttl)}
+        })
+        if cached is not None:
+            LOGGER.debug('Using cached field information')
+            fields_ = {f['name']: {'type': f['type']}
+                       for f in cached['fields']}
+            return fields_, cached['updated']
+
+        fields_ = self._sample_fields()
+
+        try:
+            cache.create_index('updated',
+                               expireAfterSeconds=self.fields_cache_ttl)
+        except OperationFailure as err:
+            LOGGER.debug('Keeping existing TTL index: {}'.format(err))
+
+        # field names may contain dots, so store them as values
+        try:
+            cache.replace_one({'_id': self.collection}, {
+                'fields': [{'name': k, 'type': v['type']}
+                           for k, v in fields_.items()],
+                'updated': now
+            }, upsert=True)
+        except OperationFailure as err:
+            LOGGER.warning('Cannot cache field information: {}'.format(err))
+
+        return fields_, now
+
+    def _sample_fields(self):
+        """
+        Discover field information from a random sample of documents,
+        so that the whole collection is never scanned
+
+        Every sampled document is read, integer and float values of a
+        field merge to number, other mixed or untyped values to string.
+
         :returns: dict of fields
         """
-        map = Code(
-            "function() { for (var key in this.properties) "
-            "{ emit(key, null); } }")
-        reduce = Code("function(key, stuff) { return null; }")
-        result = self.featuredb[self.collection].map_reduce(
-            map, reduce, "myresults")
-        return result.distinct('_id')
+        types = {}
+
+        pipeline = [
+            {'$sample': {'size': FIELD_SAMPLE_SIZE}},
+            {'$project': {'_id': 0, 'properties': 1}}
+        ]
+
+        for doc in self.featuredb[self.collection].aggregate(pipeline):
+            for k, v in (doc.get('properties') or {}).items():
+                observed = types.setdefault(k, set())
+                type_ = FIELD_TYPES.get(type(v))
+                if type_ is not None:
+                    observed.add(type_)
+
+        fields_ = {}
+        for k, observed in types.items():
+            if len(observed) == 1:
+                fields_[k] = {'type': observed.pop()}
+            elif observed == {'integer', 'number'}:
+                fields_[k] = {'type': 'number'}
+            else:
+                fields_[k] = {'type': 'string'}
+
+        return fields_
+
+    def _get_feature_list(self, filterObj, sortList=[], skip=0, maxitems=1,
+                          projection=None, batch_size=0, hint=None):
+        """
+        Fetch a page of features
 
-    def _get_feature_list(self, filterObj, sortList=[], skip=0, maxitems=1):
-        featurecursor = self.featuredb[self.collection].find(filterObj)
+        Sorts that do not fit in server memory fail instead of spilling
+        to disk.
+
+        :param filterObj: MongoDB filter document
+        :param sortList: list of (key, direction) tuples
+        :param skip: number of matching features to skip
+        :param maxitems: maximum number of features to return
+        :param projection: fields to return, defaults to whole documents
+        :param batch_size: cursor batch size (0 lets the server decide)
+        :param hint: index to use, as a list of (key, direction) tuples
+
+        :returns: generator of features
+        """
+        featurecursor = self._find(filterObj, sortList, skip, maxitems,
+                                   projection, batch_size, hint)
+
+        def _iter_features():
+            for item in featurecursor:
+                item['id'] = str(item.pop('_id'))
+                yield item
+
+        return _iter_features()
+
+    def _find(self, filterObj, sortList=[], skip=0, maxitems=0,
+              projection=None, batch_size=0, hint=None):
+        """
+        Open a feature cursor, see _get_feature_list for parameters
+
+        :returns: pymongo.cursor.Cursor
+        """
+        kwargs = {}
+        if _find_accepts_disk_use(self.data):
+            kwargs['allow_disk_use'] = False
+
+        featurecursor = self.featuredb[self.collection].find(
+            filterObj, projection=projection, batch_size=batch_size,
+            **kwargs)
 
         if sortList:
             featurecursor = featurecursor.sort(sortList)
 
-        matchCount = self.featuredb[self.collection].count_documents(filterObj)
+        if hint:
+            featurecursor = featurecursor.hint(hint)
+
         featurecursor.skip(skip)
         featurecursor.limit(maxitems)
-        featurelist = list(featurecursor)
-        for item in featurelist:
-            item['id'] = str(item.pop('_id'))
 
-        return featurelist, matchCount
+        return featurecursor
+
+    def _query_error(self, err, sortList=[]):
+        """
+        Log a failed MongoDB operation and wrap it for the API
+
+        :param err: pymongo.errors.OperationFailure
+        :param sortList: list of (key, direction) tuples of the query
+
+        :returns: ProviderQueryError
+        """
+        if err.code == SORT_MEMORY_ERROR and sortList:
+            LOGGER.warning('Sort exceeded server memory, consider an index '
+                           'on: {}'.format([s[0] for s in sortList]))
+        LOGGER.error(err)
+        return ProviderQueryError(err)
+
+    def _count(self, filterObj, count_mode='exact'):
+        """
+        Count features matching a filter
+
+        :param filterObj: MongoDB filter document
+        :param count_mode: `exact` runs count_documents, `estimate` uses
+                           collection metadata (only valid without a
+                           filter)
+
+        :returns: number of matching features
+        """
+        collection = self.featuredb[self.collection]
+        try:
+            if count_mode == 'estimate' and not filterObj:
+                return collection.estimated_document_count()
+            return collection.count_documents(filterObj)
+        except OperationFailure as err:
+            raise self._query_error(err)
+
+    def _parse_bbox(self, bbox):
+        """
+        Clamp a bounding box to valid lon/lat bounds and validate it
+
+        :param bbox: bounding box [minx,miny,maxx,maxy], with minx > maxx
+                     when crossing the antimeridian
+
+        :returns: tuple of floats (minx, miny, maxx, maxy)
+        """
+        if len(bbox) != 4:
+            msg = 'bbox values should be minx,miny,maxx,maxy'
+            LOGGER.error(msg)
+            raise ProviderQueryError(msg)
+
+        # the API already passes floats, only coerce anything else
+        if not all(isinstance(c, float) for c in bbox):
+            try:
+                bbox = [float(c) for c in bbox]
+            except (TypeError, ValueError):
+                msg = 'bbox values must be numbers'
+                LOGGER.error(msg)
+                raise ProviderQueryError(msg)
+
+        # 2dsphere queries need valid geographic coordinates
+        minx, maxx = [min(max(x, -180.0), 180.0) for x in bbox[0::2]]
+        miny, maxy = [min(max(y, -90.0), 90.0) for y in bbox[1::2]]
+
+        # minx > maxx is a box crossing the antimeridian
+        width = maxx - minx if minx <= maxx else maxx + 360 - minx
+        if width <= 0 or maxy <= miny:
+            msg = 'bbox is empty: {}'.format(bbox)
+            LOGGER.error(msg)
+            raise ProviderQueryError(msg)
+
+        return minx, miny, maxx, maxy
+
+    def _parse_datetime(self, value):
+        """
+        Parse a datetime bound, expanding partial dates to their period
+
+        Values with seconds are exact instants, while `2019`, `2019-06`
+        or `2019-06-01` name the whole year, month or day.
+
+        :param value: RFC 3339 datetime or its leading components
+
+        :returns: tuple of start and exclusive end datetimes, end being
+                  None for exact instants
+        """
+        try:
+            start = dateparse(value, default=DATETIME_DEFAULT)
+            # components missing from the value take the probe defaults
+            probe = dateparse(value, default=DATETIME_PROBE)
+
+            if start.year != probe.year:
+                raise ValueError('year missing')
+            if start.second == probe.second:
+                return start, None
+            if start.minute == probe.minute:
+                return start, start + timedelta(minutes=1)
+            if start.hour == probe.hour:
+                return start, start + timedelta(hours=1)
+            if start.day == probe.day:
+                return start, start + timedelta(days=1)
+            if start.month == probe.month:
+                if start.month == 12:
+                    return start, start.replace(year=start.year + 1,
+                                                month=1)
+                return start, start.replace(month=start.month + 1)
+            return start, start.replace(year=start.year + 1)
+        except (ValueError, OverflowError) as err:
+            msg = 'Invalid datetime {}: {}'.format(value, err)
+            LOGGER.error(msg)
+            raise ProviderQueryError(msg)
+
+    def _get_datetime_filter(self, datetime_):
+        """
+        Build a filter on the time field from an OGC API datetime value
+
+        The bounds are passed as native datetimes, so that the index on
+        the time field can be used. Time values must be stored as BSON
+        dates: ISO 8601 strings, as loaded from plain GeoJSON, never
+        compare equal to a date and silently match nothing.
+
+        :param datetime_: time instant or `begin/end` envelope, where
+                          `..` marks an open end
+
+        :returns: dict of MongoDB filter
+        """
+        if self._time_key is None:
+            LOGGER.error('time_field not enabled for collection')
+            raise ProviderQueryError()
+
+        bounds = datetime_.split('/')
+        if len(bounds) > 2:
+            msg = 'Invalid datetime {}: too many bounds'.format(datetime_)
+            LOGGER.error(msg)
+            raise ProviderQueryError(msg)
+
+        if len(bounds) == 2:  # envelope
+            LOGGER.debug('detected time range')
+            time_begin, time_end = bounds
+            range_ = {}
+            if time_begin not in ('', '..'):
+                range_['$gte'] = self._parse_datetime(time_begin)[0]
+            if time_end not in ('', '..'):
+                end, end_next = self._parse_datetime(time_end)
+                if end_next is None:
+                    range_['$lte'] = end
+                else:
+                    range_['$lt'] = end_next
+            return {self._time_key: range_} if range_ else {}
+
+        LOGGER.debug('detected time instant')
+        start, end_next = self._parse_datetime(datetime_)
+        if end_next is None:
+            return {self._time_key: start}
+        return {self._time_key: {'$gte': start, '$lt': end_next}}
 
     def query(self, startindex=0, limit=10, resulttype='results',
               bbox=[], datetime=None, properties=[], sortby=[]):
         """
         query the provider
 
+        Results are served from an in process cache for
+        `query_cache_ttl` seconds when enabled.
+
         :returns: dict of 0..n GeoJSON features
         """
-        and_filter = []
+        if not self.query_cache_ttl:
+            return self._query(startindex, limit, resulttype, bbox,
+                               datetime, properties, sortby)
+
+        # options shaping the filter or the count are part of the key
+        key = (self.data, self.collection, self._bbox_operator,
+               self.time_field, self.exact_count, startindex, limit,
+               resulttype, tuple(bbox), datetime,
+               tuple(sorted(tuple(prop) for prop in properties)),
+               tuple((sort['property'], sort['order']) for sort in sortby))
+
+        now = time.monotonic()
+        with _QUERY_CACHE_LOCK:
+            generation = _QUERY_GENERATIONS.get(key[:2], 0)
+            cached = _QUERY_CACHE.get(key)
+            if cached is not None and cached[0] > now:
+                LOGGER.debug('Using cached query result')
+                _QUERY_CACHE.move_to_end(key)
+                # callers decorate the result, so never hand out the original
+                return deepcopy(cached[1])
+
+        feature_collection = self._query(startindex, limit, resulttype, bbox,
+                                         datetime, properties, sortby)
+
+        with _QUERY_CACHE_LOCK:
+            if _QUERY_GENERATIONS.get(key[:2], 0) != generation:
+                LOGGER.debug('Collection written during query, not caching')
+                return feature_collection
+            _QUERY_CACHE[key] = (now + self.query_cache_ttl,
+                                 deepcopy(feature_collection))
+            _QUERY_CACHE.move_to_end(key)
+            while len(_QUERY_CACHE) > QUERY_CACHE_SIZE:
+                _QUERY_CACHE.popitem(last=False)
 
-        if len(bbox) == 4:
-            x, y, w, h = map(float, bbox)
-            and_filter.append(
-                {'geometry': {'$geoWithin': {'$box': [[x, y], [w, h]]}}})
+        return feature_collection
+
+    def _clear_query_cache(self):
+        """
+        Drop cached query results of this collection
+        """
+        collection = (self.data, self.collection)
+        with _QUERY_CACHE_LOCK:
+            _QUERY_GENERATIONS[collection] = \
+                _QUERY_GENERATIONS.get(collection, 0) + 1
+            for key in list(_QUERY_CACHE):
+                if key[:2] == collection:
+                    del _QUERY_CACHE[key]
+
+    def _build_query(self, bbox, datetime, properties, sortby):
+        """
+        Translate OGC API query parameters to MongoDB
+
+        :param bbox: bounding box [minx,miny,maxx,maxy]
+        :param datetime: temporal (datestamp or extent)
+        :param properties: list of tuples (name, value)
+        :param sortby: list of dicts (property, order)
+
+        :returns: tuple of filter, sort list, index hint and count mode
+        """
+        and_filter = []
+        # equality matches on distinct keys need no $and
+        eq_filter = {}
+        spatial = False
+
+        if bbox:
+            x, y, w, h = self._parse_bbox(bbox)
+            if x <= w and w - x >= 360 and y <= -90 and h >= 90:
+                LOGGER.debug('bbox covers the whole globe, not filtering')
+            else:
+                spatial = True
+                bbox_filter = [
+                    {'geometry': {self._bbox_operator: {'$geometry': p}}}
+                    for p in bbox_polygons(x, y, w, h)]
+                if len(bbox_filter) == 1:
+                    and_filter.append(bbox_filter[0])
+                else:
+                    and_filter.append({'$or': bbox_filter})
 
-        # This parameter is not working yet!
-        # gte is not sufficient to check date range
         if datetime is not None:
-            assert isinstance(datetime.datetime, datetime)
-            and_filter.append({'properties.datetime': {'$gte': datetime}})
+            datetime_filter = self._get_datetime_filter(datetime)
+            if datetime_filter:
+                and_filter.append(datetime_filter)
 
         for prop in properties:
-            and_filter.append({"properties."+prop[0]: {'$eq': prop[1]}})
+            eq_filter["properties." + prop[0]] = prop[1]
 
-        filterobj = {'$and': and_filter} if and_filter else {}
+        filterobj = eq_filter
+        if and_filter:
+            filterobj['$and'] = and_filter
 
         sort_list = [("properties." + sort['property'],
                       ASCENDING if (sort['order'] == 'A') else DESCENDING)
                      for sort in sortby]
 
-        featurelist, matchcount = self._get_feature_list(filterobj,
-                                                         sortList=sort_list,
-                                                         skip=startindex,
-                                                         maxitems=limit)
+        hint = None
+        if (self._time_key is not None and sort_list and
+                sort_list[0][0] == self._time_key and
+                not eq_filter and not spatial and
+                ((self._time_key, ASCENDING),) in self._indexes):
+            # the time index serves both the datetime filter and the sort
+            hint = [(self._time_key, ASCENDING)]
+
+        if filterobj or self.exact_count:
+            count_mode = 'exact'
+        else:
+            count_mode = 'estimate'
+
+        return filterobj, sort_list, hint, count_mode
+
+    def _query(self, startindex, limit, resulttype, bbox, datetime,
+               properties, sortby):
+        """
+        Run a query against MongoDB, see query for parameters
+
+        :returns: dict of 0..n GeoJSON features
+        """
+        if self.auto_index:
+            self._ensure_index_for_properties([prop[0] for prop in properties])
+
+        filterobj, sort_list, hint, count_mode = self._build_query(
+            bbox, datetime, properties, sortby)
 
         if resulttype == 'hits':
+            LOGGER.debug('hits only specified')
             featurelist = []
+            matchcount = self._count(filterobj, count_mode)
+        else:
+            features = self._get_feature_list(
+                filterobj, sortList=sort_list, skip=startindex,
+                maxitems=limit, projection=FEATURE_PROJECTION,
+                batch_size=limit, hint=hint)
+            try:
+                featurelist = list(features)
+            except OperationFailure as err:
+                raise self._query_error(err, sort_list)
+
+            if len(featurelist) < limit and (featurelist or startindex == 0):
+                # a partial page ends with the last match, no count needed
+                matchcount = startindex + len(featurelist)
+            else:
+                matchcount = self._count(filterobj, count_mode)
 
         feature_collection = {
             'type': 'FeatureCollection',
@@ -147,14 +869,31 @@ class MongoProvider(BaseProvider):
         :param identifier: feature id
         :returns: dict of single GeoJSON feature
         """
-        featurelist, matchcount = self._get_feature_list(
-                                    {'_id': ObjectId(identifier)})
-        return featurelist[0] if featurelist else None
+        if not ObjectId.is_valid(identifier):
+            LOGGER.debug('Invalid feature id: {}'.format(identifier))
+            return None
+
+        feature = self.featuredb[self.collection].find_one(
+            {'_id': ObjectId(identifier)}, projection=FEATURE_PROJECTION)
+        if feature is not None:
+            feature['id'] = str(feature.pop('_id'))
+        return feature
 
     def create(self, new_feature):
         """Create a new feature
         """
         self.featuredb[self.collection].insert_one(new_feature)
+        self._clear_query_cache()
+
+    def create_many(self, new_features):
+        """Create new features in a single round trip
+
+        :param new_features: list of GeoJSON feature dictionaries
+        """
+        if new_features:
+            self.featuredb[self.collection].insert_many(new_features,
+                                                        ordered=False)
+            self._clear_query_cache()
 
     def update(self, identifier, updated_feature):
         """Updates an existing feature id with new_feature
@@ -165,6 +904,22 @@ class MongoProvider(BaseProvider):
         data = {k: v for k, v in updated_feature.items() if k != 'id'}
         self.featuredb[self.collection].update_one(
             {'_id': ObjectId(identifier)}, {"$set": data})
+        self._clear_query_cache()
+
+    def update_many(self, updates):
+        """Updates existing features in a single round trip
+
+        :param updates: list of (identifier, new_feature) tuples
+        """
+        requests = [
+            UpdateOne({'_id': ObjectId(identifier)},
+                      {"$set": {k: v for k, v in updated_feature.items()
+                                if k != 'id'}})
+            for identifier, updated_feature in updates]
+        if requests:
+            self.featuredb[self.collection].bulk_write(requests,
+                                                       ordered=False)
+            self._clear_query_cache()
 
     def delete(self, identifier):
         """Delets an existing feature
@@ -173,3 +928,13 @@ class MongoProvider(BaseProvider):
         """
         self.featuredb[self.collection].delete_one(
             {'_id': ObjectId(identifier)})
+        self._clear_query_cache()
+
+    def delete_many(self, identifiers):
+        """Deletes existing features in a single round trip
+
+        :param identifiers: list of feature ids
+        """
+        self.featuredb[self.collection].delete_many(
+            {'_id': {'$in': [ObjectId(i) for i in identifiers]}})
+        self._clear_query_cache()
@@ -27,9 +27,16 @@
 #
 # =================================================================
 
+from datetime import datetime
+import warnings
+
 import pytest
+from pymongo import ASCENDING, MongoClient
 
-from pygeoapi.provider.mongo import MongoProvider
+from pygeoapi.provider.base import ProviderQueryError
+from pygeoapi.provider.mongo import (CLIENT_DEFAULTS, FIELDS_CACHE_COLLECTION,
+                                     MongoProvider, bbox_polygon,
+                                     bbox_polygons)
 
 monogourl = 'mongodb://localhost:27017/testdb'
 mongocollection = 'testplaces'
@@ -72,6 +79,14 @@ def test_query(config):
     assert results['numberReturned'] == 1
     assert results['features'][0]['properties']['nameascii'] == 'Vatican City'
 
+    results = p.query(properties=[('nameascii', 'Vatican City'),
+                                  ('sov_a3', 'VAT')])
+    assert results['numberMatched'] == 1
+
+    results = p.query(properties=[('nameascii', 'Vatican City'),
+                                  ('sov_a3', 'FIN')])
+    assert results['numberMatched'] == 0
+
     results = p.query(limit=1)
     assert len(results['features']) == 1
     assert results['features'][0]['properties']['nameascii'] == 'Vatican City'
@@ -80,6 +95,14 @@ def test_query(config):
     assert len(results['features']) == 1
     assert results['features'][0]['properties']['nameascii'] == 'Vaduz'
 
+    results = p.query(startindex=240, limit=10)
+    assert len(results['features']) == 3
+    assert results['numberMatched'] == 243
+
+    results = p.query(startindex=250, limit=10)
+    assert len(results['features']) == 0
+    assert results['numberMatched'] == 243
+
     results = p.query(sortby=[{'property': 'nameascii', 'order': 'A'}])
     assert results['features'][0]['properties']['nameascii'] == 'Abidjan'
 
@@ -96,6 +119,338 @@ def test_query(config):
     print(len(results['features'][0]['properties']))
     assert len(results['features'][0]['properties']) == 37
 
+    results = p.query(bbox=[12, 41, 13, 42])
+    names = [f['properties']['nameascii'] for f in results['features']]
+    assert 'Vatican City' in names
+    assert results['numberMatched'] == len(names)
+
+    results = p.query(bbox=[-180, -90, 180, 90])
+    assert results['numberMatched'] == 243
+
+    # Madrid, Paris and London lie north of the box, but south of the
+    # great circle between its north corners
+    results = p.query(bbox=[-60, 0, 60, 40], limit=100)
+    names = [f['properties']['nameascii'] for f in results['features']]
+    assert results['numberMatched'] == 65
+    assert 'Cairo' in names
+    assert 'Madrid' not in names
+    assert 'Paris' not in names
+
+    results = p.query(bbox=[-100, 0, 0, 60], limit=100)
+    names = [f['properties']['nameascii'] for f in results['features']]
+    assert results['numberMatched'] == 54
+    assert 'Ottawa' in names
+    assert 'Reykjavik' not in names
+
+    results = p.query(bbox=[-180, -85, 180, 85])
+    assert results['numberMatched'] == 243
+
+    results = p.query(bbox=[-180, -90, 180, 0])
+    assert results['numberMatched'] == 51
+
+    results = p.query(bbox=[-10, 0, 10, 90])
+    assert results['numberMatched'] == 32
+
+    results = p.query(bbox=[170, -90, -170, 90])
+    names = [f['properties']['nameascii'] for f in results['features']]
+    assert results['numberMatched'] == 8
+    assert 'Suva' in names and 'Apia' in names
+
+    results = p.query(resulttype='hits')
+    assert results['numberMatched'] == 243
+    assert results['numberReturned'] == 0
+    assert results['features'] == []
+
+    results = p.query(resulttype='hits',
+                      properties=[('nameascii', 'Vatican City')])
+    assert results['numberMatched'] == 1
+    assert results['numberReturned'] == 0
+
+
+def test_bbox_op(config):
+    p = MongoProvider(config)
+    results_intersects = p.query(bbox=[12, 41, 13, 42])
+
+    config['bbox_op'] = 'within'
+    p = MongoProvider(config)
+    results_within = p.query(bbox=[12, 41, 13, 42])
+
+    # points intersect a bbox exactly when they are within it
+    assert (results_intersects['numberMatched'] ==
+            results_within['numberMatched'])
+
+    config['bbox_op'] = 'touches'
+    with pytest.raises(ProviderQueryError):
+        MongoProvider(config)
+
+
+def test_parse_bbox(config):
+    p = MongoProvider(config)
+    assert p._parse_bbox([12.0, 41.0, 13.0, 42.0]) == (12, 41, 13, 42)
+    assert p._parse_bbox(['12', '41', '13', '42']) == (12, 41, 13, 42)
+    assert p._parse_bbox([-200, -100, 200, 100]) == (-180, -90, 180, 90)
+    assert p._parse_bbox([-10, 80, 10, 95]) == (-10, 80, 10, 90)
+
+    # crossing the antimeridian
+    assert p._parse_bbox([170, -10, -170, 10]) == (170, -10, -170, 10)
+    assert p._parse_bbox([170, -10, -200, 10]) == (170, -10, -180, 10)
+
+    # empty once clamped
+    with pytest.raises(ProviderQueryError):
+        p._parse_bbox([190, 0, 200, 10])
+    with pytest.raises(ProviderQueryError):
+        p._parse_bbox([0, 90, 10, 100])
+    with pytest.raises(ProviderQueryError):
+        p._parse_bbox([180, 0, -180, 10])
+    with pytest.raises(ProviderQueryError):
+        p._parse_bbox([12, 42, 13, 41])
+    with pytest.raises(ProviderQueryError):
+        p._parse_bbox([12, 41, 13])
+    with pytest.raises(ProviderQueryError):
+        p._parse_bbox(['a', 41, 13, 42])
+
+
+def test_bbox_polygon():
+    polygon = bbox_polygon(12, 41, 13, 42)
+    assert polygon['type'] == 'Polygon'
+    assert 'crs' in polygon
+    assert polygon['coordinates'] == [
+        [[12, 41], [13, 41], [13, 42], [12, 42], [12, 41]]]
+
+    # parallels are densified so great circle edges stay on them
+    ring = bbox_polygon(-60, 0, 60, 40)['coordinates'][0]
+    assert ring[0] == ring[-1]
+    assert [-59, 0] in ring and [0, 40] in ring
+    assert all(abs(a[0] - b[0]) <= 1 and abs(a[1] - b[1]) <= 1
+               for a, b in zip(ring, ring[1:]))
+
+    # edges on a pole collapse into a single vertex
+    ring = bbox_polygon(-10, 0, 10, 90)['coordinates'][0]
+    assert [vertex[1] for vertex in ring].count(90) == 1
+
+    # all longitudes would put the western and eastern edges on top of
+    # each other
+    polygons = bbox_polygons(-180, -85, 180, 85)
+    assert len(polygons) == 2
+    for polygon in polygons:
+        ring = polygon['coordinates'][0]
+        assert len(ring) - 1 == len(set(tuple(v) for v in ring[:-1]))
+
+
+def test_datetime_index(config):
+    config['time_field'] = 'datetime'
+    p = MongoProvider(config)
+    init(p)
+
+    filter_ = p._get_datetime_filter('2019-01-01/2019-12-31T12:00:00Z')
+    assert set(filter_['properties.datetime']) == {'$gte', '$lte'}
+
+    # partial dates cover their whole period
+    filter_ = p._get_datetime_filter('2019')
+    assert filter_['properties.datetime'] == {
+        '$gte': datetime(2019, 1, 1), '$lt': datetime(2020, 1, 1)}
+
+    filter_ = p._get_datetime_filter('2019-12')
+    assert filter_['properties.datetime'] == {
+        '$gte': datetime(2019, 12, 1), '$lt': datetime(2020, 1, 1)}
+
+    filter_ = p._get_datetime_filter('../2019-12-31')
+    assert filter_['properties.datetime'] == {'$lt': datetime(2020, 1, 1)}
+
+    for invalid in ['garbage', '2019/2020/2021', '12:00', '2019-13-01']:
+        with pytest.raises(ProviderQueryError):
+            p._get_datetime_filter(invalid)
+
+    explain = p.featuredb[p.collection].find(filter_).explain()
+    winning_plan = str(explain['queryPlanner']['winningPlan'])
+    assert 'IXSCAN' in winning_plan
+    assert 'COLLSCAN' not in winning_plan
+
+    times = [datetime(2019, 3, 1), datetime(2019, 6, 1),
+             datetime(2019, 12, 31, 12), datetime(2020, 1, 1),
+             # ISO strings are not BSON dates and never match
+             '2019-06-01T00:00:00Z']
+    p.create_many([{
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [0.0, 0.0]},
+        'properties': {
+            'name': 'Unit Test Island',
+            'datetime': time_}} for time_ in times])
+
+    results = p.query(datetime='2019-06-01T00:00:00Z')
+    assert results['numberMatched'] == 1
+    assert results['features'][0]['properties']['datetime'] == times[1]
+
+    # a date-only end includes the whole day
+    results = p.query(datetime='2019-01-01/2019-12-31')
+    assert results['numberMatched'] == 3
+
+    results = p.query(datetime='2019')
+    assert results['numberMatched'] == 3
+
+    results = p.query(datetime='2019-06')
+    assert results['numberMatched'] == 1
+
+    results = p.query(datetime='2019-05-01/..')
+    assert results['numberMatched'] == 3
+
+    results = p.query(datetime='2019-01-01/2019-12-31',
+                      sortby=[{'property': 'datetime', 'order': 'D'}])
+    assert results['numberMatched'] == 3
+    assert results['features'][0]['properties']['datetime'] == times[2]
+
+    delete_by_name(p, 'Unit Test Island')
+
+
+def test_sort_hint(config):
+    config['time_field'] = 'datetime'
+    p = MongoProvider(config)
+
+    filter_, sort_list, hint, _ = p._build_query(
+        [], None, [], [{'property': 'datetime', 'order': 'D'}])
+    assert hint == [('properties.datetime', ASCENDING)]
+
+    explain = p._find(filter_, sort_list, maxitems=10, hint=hint).explain()
+    winning_plan = str(explain['queryPlanner']['winningPlan'])
+    assert 'properties.datetime_1' in winning_plan
+    assert 'COLLSCAN' not in winning_plan
+
+    # no hint when the time index could not be ensured
+    spec = (('properties.datetime', ASCENDING),)
+    p._indexes.discard(spec)
+    try:
+        _, _, hint, _ = p._build_query(
+            [], None, [], [{'property': 'datetime', 'order': 'D'}])
+        assert hint is None
+    finally:
+        p._indexes.add(spec)
+
+
+def test_sort_memory_limit(config, caplog):
+    p = MongoProvider(config)
+    admin = p.featuredb.client.admin
+    param = 'internalQueryMaxBlockingSortMemoryUsageBytes'
+    original = admin.command('getParameter', 1, **{param: 1})[param]
+
+    admin.command('setParameter', 1, **{param: 1024})
+    try:
+        with pytest.raises(ProviderQueryError):
+            p.query(limit=243, sortby=[{'property': 'ls_name', 'order': 'A'}])
+    finally:
+        admin.command('setParameter', 1, **{param: original})
+    assert 'consider an index' in caplog.text
+
+
+def test_indexes(config):
+    config['indexes'] = [
+        {'key': 'nameascii', 'type': 'asc'},
+        {'key': ['adm0name', 'scalerank'], 'type': 'compound'}
+    ]
+    config['auto_index'] = True
+    p = MongoProvider(config)
+    init(p)
+
+    index_keys = [[key for key, _ in index['key']] for index in
+                  p.featuredb[p.collection].index_information().values()]
+    assert ['properties.nameascii'] in index_keys
+    assert ['properties.adm0name', 'properties.scalerank'] in index_keys
+
+    results = p.query(properties=[('sov_a3', 'FIN')])
+    assert (('properties.sov_a3', ASCENDING),) in p._indexes
+    # later providers of the same collection know about it
+    assert (('properties.sov_a3', ASCENDING),) in \
+        MongoProvider(config)._indexes
+    assert results['numberMatched'] == 1
+
+    index_keys = [[key for key, _ in index['key']] for index in
+                  p.featuredb[p.collection].index_information().values()]
+    assert ['properties.sov_a3'] in index_keys
+
+    # configured indexes led by a property already serve it
+    p.query(properties=[('adm0name', 'Finland'), ('nameascii', 'Helsinki')])
+    index_keys = [[key for key, _ in index['key']] for index in
+                  p.featuredb[p.collection].index_information().values()]
+    assert ['properties.adm0name'] not in index_keys
+    assert index_keys.count(['properties.nameascii']) == 1
+
+
+def test_shared_client(config):
+    p1 = MongoProvider(config)
+    p2 = MongoProvider(config)
+    assert p1.featuredb.client is p2.featuredb.client
+
+    # only compressors pymongo can use are requested
+    compressors = CLIENT_DEFAULTS['compressors']
+    assert compressors.split(',')[-1] == 'zlib'
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        MongoClient(monogourl, compressors=compressors, connect=False)
+
+
+def test_query_cache(config):
+    config['query_cache_ttl'] = 60
+    p = MongoProvider(config)
+    init(p)
+
+    results = p.query(properties=[('name', 'Null Island')])
+    assert results['numberMatched'] == 0
+
+    results['features'].append('mutated')
+    results = p.query(properties=[('name', 'Null Island')])
+    assert results['features'] == []
+
+    p.create({
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [0.0, 0.0]},
+        'properties': {
+            'name': 'Null Island'}})
+
+    # writes invalidate cached results
+    results = p.query(properties=[('name', 'Null Island')])
+    assert results['numberMatched'] == 1
+
+    delete_by_name(p, 'Null Island')
+    results = p.query(properties=[('name', 'Null Island')])
+    assert results['numberMatched'] == 0
+
+    # a write during a query keeps its stale result out of the cache
+    query = p._query
+
+    def write_during_query(*args):
+        result = query(*args)
+        p.create({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [0.0, 0.0]},
+            'properties': {
+                'name': 'Null Island'}})
+        return result
+
+    p._query = write_during_query
+    results = p.query(resulttype='hits', properties=[('name', 'Null Island')])
+    assert results['numberMatched'] == 0
+
+    p._query = query
+    results = p.query(resulttype='hits', properties=[('name', 'Null Island')])
+    assert results['numberMatched'] == 1
+    delete_by_name(p, 'Null Island')
+
+    # providers configured differently do not share results
+    config['time_field'] = 'datetime'
+    p = MongoProvider(config)
+    results = p.query(datetime='../2019-12-31')
+    assert results['numberMatched'] == 0
+
+    config['time_field'] = None
+    p = MongoProvider(config)
+    with pytest.raises(ProviderQueryError):
+        p.query(datetime='../2019-12-31')
+
 
 def test_get(config):
     p = MongoProvider(config)
@@ -103,6 +458,9 @@ def test_get(config):
     results = p.get('123456789012345678901234')
     assert results is None
 
+    results = p.get('not-an-object-id')
+    assert results is None
+
     res = p.query(properties=[['nameascii', 'Reykjavik']])
     result = p.get(res['features'][0]['id'])
     assert isinstance(result, dict)
@@ -112,8 +470,50 @@ def test_get(config):
 def test_get_fields(config):
     p = MongoProvider(config)
     init(p)
-    results = p.get_fields()
+    # discover again, as the schema cache may have been filled earlier
+    results = p.refresh_fields()
     assert len(results) == 37
+    assert results['nameascii']['type'] == 'string'
+    assert results['scalerank']['type'] == 'integer'
+    assert results['latitude']['type'] == 'number'
+    assert p.fields == results
+    assert p.get_fields() == results
+
+    # discovered fields are shared through the schema cache collection
+    cached = p.featuredb[FIELDS_CACHE_COLLECTION].find_one(
+        {'_id': p.collection})
+    assert cached is not None
+    assert {f['name']: {'type': f['type']}
+            for f in cached['fields']} == results
+
+
+def test_get_fields_mixed_types(config):
+    config['collection'] = 'unit_test_fields'
+    p = MongoProvider(config)
+    p.featuredb[p.collection].delete_many({})
+
+    p.create_many([{
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [0.0, 0.0]},
+        'properties': properties} for properties in [
+            {'alt': 12, 'rank': 1, 'code': 1, 'note': None},
+            {'alt': 12.5, 'rank': 2, 'code': 'FI'},
+            {'alt': None, 'rank': None, 'code': None}]])
+
+    try:
+        results = p.refresh_fields()
+        assert results == {
+            'alt': {'type': 'number'},
+            'rank': {'type': 'integer'},
+            'code': {'type': 'string'},
+            'note': {'type': 'string'}
+        }
+    finally:
+        p.featuredb[p.collection].drop()
+        p.featuredb[FIELDS_CACHE_COLLECTION].delete_one(
+            {'_id': p.collection})
 
 
 def test_create_and_delete(config):
@@ -217,3 +617,44 @@ def test_update_safe_id(config):
     results = p.get(res['features'][0]['id'])
     assert 'Null Island' in results['properties']['name']
     delete_by_name(p, 'Null Island')
+
+
+def test_create_update_delete_many(config):
+    p = MongoProvider(config)
+    init(p)
+
+    # empty batches are no-ops
+    p.create_many([])
+    p.update_many([])
+    p.delete_many([])
+
+    new_features = [{
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [0.0, 0.0]},
+        'properties': {
+            'name': 'Unit Test Island'}} for i in range(3)]
+
+    p.create_many(new_features)
+    res = p.query(properties=[('name', 'Unit Test Island')])
+    assert len(res['features']) == 3
+
+    ids = [feature['id'] for feature in res['features']]
+    updated_feature = {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [0.0, 0.0]},
+        'properties': {
+            'name': 'Null Island'}}
+
+    p.update_many([(ids[0], updated_feature), (ids[1], updated_feature)])
+    res = p.query(properties=[('name', 'Null Island')])
+    assert len(res['features']) == 2
+
+    p.delete_many(ids)
+    res = p.query(properties=[('name', 'Null Island')])
+    assert len(res['features']) == 0
+    res = p.query(properties=[('name', 'Unit Test Island')])
+    assert len(res['features']) == 0